@@ -1,4 +1,3 @@
-import functools
 import json
 from collections import OrderedDict
 from pathlib import Path
@@ -26,6 +25,12 @@ from utils.verifications import assert_crs_match, validate_raster, \
 
 logging = get_logger(__name__)  # import logging
 
+# Optional fast vector reader (reads through GDAL's C API in bulk rather than one Python dict per feature)
+try:
+    import pyogrio
+except ModuleNotFoundError:
+    pyogrio = None
+
 
 class SingleBandItemEO(ItemEOExtension):
     """
@@ -206,6 +211,12 @@ class AOI(object):
         self.raster_read()
         self.raster_meta = self.raster.meta
         self.raster_meta['name'] = self.raster.name
+        # Compute ground area covered by raster once, while the handle is open. Reused by to_dict(), therefore by
+        # reporting steps, without reopening the raster (e.g. if "for_multiprocessing" is True, handle is closed below)
+        try:
+            self.raster_area = (self.raster.res[0] * self.raster.width) * (self.raster.res[1] * self.raster.height)
+        except AttributeError:
+            self.raster_area = None
         if self.raster_src_is_multiband:
             self.raster_name = self.raster.name
         else:
@@ -220,7 +231,7 @@ class AOI(object):
         # Check label data
         if label:
             self.label = Path(label)
-            self.label_gdf = _check_gdf_load(str(label))
+            self.label_gdf = self.read_label_gdf(label)
             self.bounds_iou = self.bounds_iou_gdf_riodataset(
                 gdf=self.label_gdf,
                 raster=self.raster)
@@ -289,7 +300,7 @@ class AOI(object):
                             f'Got {attr_values_filter} of type {type(attr_values_filter)}')
         self.attr_values_filter = attr_values_filter
         label_gdf_filtered = self.filter_gdf_by_attribute(
-            self.label_gdf.copy(deep=True),
+            self.label_gdf,
             self.attr_field_filter,
             self.attr_values_filter,
         )
@@ -369,17 +380,13 @@ class AOI(object):
 
     def to_dict(self, extended=True):
         """returns a dictionary containing all important attributes of AOI (ex.: to print a report or output csv)"""
-        try:
-            raster_area = (self.raster.res[0] * self.raster.width) * (self.raster.res[1] * self.raster.height)
-        except AttributeError:
-            raster_area = None
         out_dict = {
             'raster': self.raster_raw_input,
             'label': self.label,
             'split': self.split,
             'id': self.aoi_id,
             'raster_parsed': self.raster_parsed,
-            'raster_area': raster_area,
+            'raster_area': self.raster_area,
             'raster_meta': self.raster_meta,
             'label_features_nb': len(self.label_gdf),
             'label_features_filtered_nb': len(self.label_gdf_filtered),
@@ -389,7 +396,28 @@ class AOI(object):
             'crs_match': self.crs_match
         }
         if extended:
-            mean_ext_vert_nb = None
+            mean_ext_vert_nb = self.label_features_mean_exterior_vertices_nb()
+
+            out_dict.update({
+                'label_features_filtered_mean_area': np.mean(self.label_gdf_filtered.area),
+                'label_features_filtered_mean_perimeter': np.mean(self.label_gdf_filtered.length),
+                'label_features_filtered_mean_exterior_vertices_nb': mean_ext_vert_nb
+            })
+        return out_dict
+
+    def label_features_mean_exterior_vertices_nb(self):
+        """Mean number of exterior-ring vertices over all (multi)polygon parts of filtered ground truth features"""
+        mean_ext_vert_nb = None
+        try:
+            # shapely 2.0's vectorized api counts vertices in a few C calls over the whole geometry column,
+            # rather than one python iteration per feature, and handles mixed Polygon/MultiPolygon columns
+            # (see former TODOs about MB18 and Kingston1)
+            from shapely import get_exterior_ring, get_num_coordinates, get_parts
+            rings = get_exterior_ring(get_parts(self.label_gdf_filtered.geometry.values))
+            rings = rings[rings != None]  # non-polygonal parts have no exterior ring
+            if len(rings) > 0:
+                mean_ext_vert_nb = np.mean(get_num_coordinates(rings))
+        except ImportError:  # shapely < 2.0: fall back to per-feature iteration
             try:
                 if isinstance(list(self.label_gdf_filtered.geometry)[0], MultiPolygon):
                     ext_vert = []
@@ -398,18 +426,12 @@ class AOI(object):
                     mean_ext_vert_nb = np.mean(ext_vert)
                 elif isinstance(list(self.label_gdf_filtered.geometry)[0], Polygon):
                     mean_ext_vert_nb = np.mean([len(geom.exterior.coords) for geom in self.label_gdf_filtered.geometry])
-            # TODO: resolve with MB18 ('Polygon' object is not iterable)
-            # TODO: Kingston1 ('MultiPolygon' object has no attribute 'exterior')
             # TODO: AB11 (0 filtered features)
             except Exception as e:
                 logging.warning(e)
-
-            out_dict.update({
-                'label_features_filtered_mean_area': np.mean(self.label_gdf_filtered.area),
-                'label_features_filtered_mean_perimeter': np.mean(self.label_gdf_filtered.length),
-                'label_features_filtered_mean_exterior_vertices_nb': mean_ext_vert_nb
-            })
-        return out_dict
+        except Exception as e:
+            logging.warning(e)
+        return mean_ext_vert_nb
 
     def calc_raster_stats(self):
         """ For stac items formatted as expected, reads mean and std of raster imagery, per band.
@@ -478,6 +500,22 @@ class AOI(object):
             write_array=self.raster.read())
         return out_tif_path
 
+    @staticmethod
+    def read_label_gdf(label: Union[str, Path]) -> gpd.GeoDataFrame:
+        """
+        Loads a ground truth file to a GeoDataFrame, using pyogrio's bulk reader when installed.
+        Falls back to the fiona-based loader if pyogrio is missing or fails on the input file.
+        @param label: pathlib.Path or str
+            Path to ground truth file
+        @return: GeoDataFrame containing ground truth features
+        """
+        if pyogrio is not None:
+            try:
+                return pyogrio.read_dataframe(str(label), use_arrow=True)
+            except Exception as e:
+                logging.debug(f"pyogrio could not read \"{label}\". Falling back to fiona reader.\n{e}")
+        return _check_gdf_load(str(label))
+
     @staticmethod
     def parse_input_raster(
             csv_raster_str: str,
@@ -506,12 +544,8 @@ class AOI(object):
             raster = [csv_raster_str.replace("${dataset.bands}", band) for band in raster_bands_requested]
             return raster
         else:
-            try:
-                validate_raster(csv_raster_str)
-                return [csv_raster_str]
-            except (FileNotFoundError, rasterio.RasterioIOError, TypeError) as e:
-                logging.critical(f"Couldn't parse input raster. Got {csv_raster_str}")
-                raise e
+            # no parsing required: validation of parsed rasters happens once in __init__, after optional download
+            return [csv_raster_str]
 
     @staticmethod
     def bounds_iou(polygon1: Polygon, polygon2: Polygon) -> float:
@@ -541,16 +575,18 @@ class AOI(object):
         Filter features from a geopandas.GeoDataFrame according to an attribute field and filtering values
         @param gdf_tile: str, Path or gpd.GeoDataFrame
             GeoDataFrame or path to GeoDataFrame to filter feature from
-        @return: Subset of source GeoDataFrame with only filtered features (deep copy)
+        @return: Subset of source GeoDataFrame with only filtered features
         """
         gdf_tile = _check_gdf_load(gdf_tile)
         if gdf_tile.empty or not attr_field or not attr_vals:
             return gdf_tile
         try:
-            condList = [gdf_tile[f'{attr_field}'] == val for val in attr_vals]
-            condList.extend([gdf_tile[f'{attr_field}'] == str(val) for val in attr_vals])
-            allcond = functools.reduce(lambda x, y: x | y, condList)  # combine all conditions with OR
-            gdf_filtered = gdf_tile[allcond].copy(deep=True)
+            # Single hash-based isin() instead of one boolean mask per value OR-reduced in Python.
+            # Values are looked up both as-is and as strings, since attribute may be stored either way.
+            attr_vals_mixed_dtype = list(attr_vals) + [str(val) for val in attr_vals]
+            allcond = gdf_tile[f'{attr_field}'].isin(attr_vals_mixed_dtype)
+            # boolean selection already materializes a new frame; no need to deep-copy geometries on top of it
+            gdf_filtered = gdf_tile[allcond]
             logging.debug(f'Successfully filtered features from GeoDataFrame"\n'
                           f'Filtered features: {len(gdf_filtered)}\n'
                           f'Total features: {len(gdf_tile)}\n'
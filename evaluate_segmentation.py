@@ -1,4 +1,5 @@
 import itertools
+import multiprocessing
 import time
 from collections import defaultdict
 from pathlib import Path
@@ -7,26 +8,26 @@ from typing import Sequence
 import numpy as np
 import pandas as pd
 import rasterio
-from mlflow import log_metrics
+from rasterio.windows import Window
 from shapely.geometry import Polygon
 from tqdm import tqdm
 import geopandas as gpd
 
 from utils.geoutils import vector_to_raster
 from utils.metrics import ComputePixelMetrics
-from utils.utils import get_key_def, list_input_images
+from utils.utils import get_key_def, list_input_images, map_wrapper
 from utils.logger import get_logger
 from utils.verifications import validate_num_classes, assert_crs_match
 
 logging = get_logger(__name__)
 
 
-def metrics_per_tile(label_arr: np.ndarray, pred_img: np.ndarray, input_image: rasterio.DatasetReader,
+def metrics_per_tile(label_arr: np.ndarray, pred_src: rasterio.DatasetReader, input_image: rasterio.DatasetReader,
                      chunk_size: int, gpkg_name: str, num_classes: int) -> gpd.GeoDataFrame:
     """
     Compute metrics for each tile processed during inference
     @param label_arr: numpy array of label
-    @param pred_img: numpy array of prediction
+    @param pred_src: Rasterio file handle holding the (already opened) prediction raster
     @param input_image: Rasterio file handle holding the (already opened) input raster
     @param chunk_size: tile size for per-tile metrics
     @param gpkg_name: name of geopackage
@@ -44,13 +45,17 @@ def metrics_per_tile(label_arr: np.ndarray, pred_img: np.ndarray, input_image: r
     for row, col in tqdm(itertools.product(range(0, h, chunk_size), range(0, w, chunk_size)), leave=False,
                          desc="Calculating metrics per tile"):
         label = label_arr[row:row + chunk_size, col:col + chunk_size]
-        pred = pred_img[row:row + chunk_size, col:col + chunk_size]
+        # read only the evaluated tile from the prediction raster; rasterio clips the window at the edges
+        pred = pred_src.read(1, window=Window.from_slices(slice(row, row + chunk_size), slice(col, col + chunk_size)))
         pixelMetrics = ComputePixelMetrics(label.flatten(), pred.flatten(), num_classes)
         eval = pixelMetrics.update(pixelMetrics.iou)
         feature['id_image'].append(gpkg_name)
+        # count all classes in one pass per array instead of one full boolean scan per class
+        label_counts = np.bincount(label.flatten(), minlength=num_classes)
+        pred_counts = np.bincount(pred.flatten(), minlength=num_classes)
         for c_num in range(num_classes):
-            feature['L_count_' + str(c_num)].append(int(np.count_nonzero(label == c_num)))
-            feature['P_count_' + str(c_num)].append(int(np.count_nonzero(pred == c_num)))
+            feature['L_count_' + str(c_num)].append(int(label_counts[c_num]))
+            feature['P_count_' + str(c_num)].append(int(pred_counts[c_num]))
             feature['IoU_' + str(c_num)].append(eval['iou_' + str(c_num)])
         feature['mIoU'].append(eval['macro_avg_iou'])
         logging.debug(eval['macro_avg_iou'])
@@ -70,6 +75,59 @@ def metrics_per_tile(label_arr: np.ndarray, pred_img: np.ndarray, input_image: r
     return gdf
 
 
+def evaluate_per_image(info: dict, working_folder: Path, attribute_field: str, attr_vals: Sequence,
+                       chunk_size: int, num_classes: int, debug: bool = False):
+    """
+    Evaluates a single image's inference against its burned ground truth
+    @param info: dictionary of input data for image as read from input csv
+    @param working_folder: folder containing inferences
+    @param attribute_field: name of the attribute field used to filter features
+    @param attr_vals: list of attribute values for features to keep
+    @param chunk_size: tile size for per-tile metrics
+    @param num_classes: number of classes
+    @param debug: True/False
+    @return: tuple of (metrics GeoDataFrame reprojected to WGS84, ground truth stem)
+    """
+    local_img = Path(info['tif'])
+    Path.mkdir(working_folder.joinpath(local_img.parent.name), parents=True, exist_ok=True)
+    inference_image = working_folder / local_img.parent.name / f"{local_img.stem}_inference.tif"
+    if not inference_image.is_file():
+        raise FileNotFoundError(f"Couldn't locate inference to evaluate metrics with. Make inferece has been run "
+                                f"before you run evaluate mode.")
+
+    # keep the prediction raster on disk: metrics_per_tile reads it window by window, so the whole
+    # class map never has to be resident in memory alongside the burned label
+    pred_src = rasterio.open(inference_image)
+
+    local_gpkg = Path(info['gpkg'])
+
+    logging.info(f'\nBurning label as raster: {local_gpkg}')
+    raster = rasterio.open(local_img, 'r')
+    logging.info(f'\nReading image: {raster.name}')
+    inf_meta = raster.meta
+
+    try:
+        label = vector_to_raster(vector_file=local_gpkg,
+                                 input_image=raster,
+                                 out_shape=(inf_meta['height'], inf_meta['width']),
+                                 attribute_name=attribute_field,
+                                 fill=0,  # background value in rasterized vector.
+                                 attribute_values=attr_vals)
+    except ValueError:
+        # no feature intersects the raster's extent: benchmark against an all-background label
+        logging.warning(f"No vector features found for {local_gpkg} with provided configuration. "
+                        f"Metrics will be computed against an all-background label.")
+        label = np.zeros((inf_meta['height'], inf_meta['width']), dtype=np.int16)
+    if debug:
+        logging.debug(f'\nUnique values in loaded label as raster: {np.unique(label)}\n'
+                      f'Shape of label as raster: {label.shape}')
+
+    gdf = metrics_per_tile(label_arr=label, pred_src=pred_src, input_image=raster, chunk_size=chunk_size,
+                           gpkg_name=local_gpkg.stem, num_classes=num_classes)
+    pred_src.close()
+    return gdf.to_crs(4326), local_gpkg.stem
+
+
 def main(params):
     """
     Computes benchmark metrics from inference and ground truth and write results to a gpkg.
@@ -95,6 +153,7 @@ def main(params):
     dontcare = get_key_def("ignore_index", params["dataset"], -1)
     attribute_field = get_key_def('attribute_field', params['dataset'], None, expected_type=str)
     attr_vals = get_key_def('attribute_values', params['dataset'], None, expected_type=Sequence)
+    parallel = get_key_def('multiprocessing', params['inference'], default=False, expected_type=bool)
 
     # Assert that all values are integers (ex.: to benchmark single-class model with multi-class labels)
     if attr_vals:
@@ -116,43 +175,26 @@ def main(params):
     gdf_ = []
     gpkg_name_ = []
 
+    input_args = []
     for info in tqdm(list_img, desc='Evaluating from input list', position=0, leave=True):
-        local_img = Path(info['tif'])
-        Path.mkdir(working_folder.joinpath(local_img.parent.name), parents=True, exist_ok=True)
-        inference_image = working_folder / local_img.parent.name / f"{local_img.stem}_inference.tif"
-        if not inference_image.is_file():
-            raise FileNotFoundError(f"Couldn't locate inference to evaluate metrics with. Make inferece has been run "
-                                    f"before you run evaluate mode.")
-
-        pred = rasterio.open(inference_image).read()[0, ...]
-
-        local_gpkg = Path(info['gpkg'])
-
-        logging.info(f'\nBurning label as raster: {local_gpkg}')
-        raster = rasterio.open(local_img, 'r')
-        logging.info(f'\nReading image: {raster.name}')
-        inf_meta = raster.meta
-
-        label = vector_to_raster(vector_file=local_gpkg,
-                                 input_image=raster,
-                                 out_shape=(inf_meta['height'], inf_meta['width']),
-                                 attribute_name=attribute_field,
-                                 fill=0,  # background value in rasterized vector.
-                                 attribute_values=attr_vals)
-        if debug:
-            logging.debug(f'\nUnique values in loaded label as raster: {np.unique(label)}\n'
-                          f'Shape of label as raster: {label.shape}')
-
-        gdf = metrics_per_tile(label_arr=label, pred_img=pred, input_image=raster, chunk_size=chunk_size,
-                               gpkg_name=local_gpkg.stem, num_classes=num_classes)
-
-        gdf_.append(gdf.to_crs(4326))
-        gpkg_name_.append(local_gpkg.stem)
-
-        if 'tracker_uri' in locals():
-            pixelMetrics = ComputePixelMetrics(label, pred, num_classes)
-            log_metrics(pixelMetrics.update(pixelMetrics.iou))
-            log_metrics(pixelMetrics.update(pixelMetrics.dice))
+        if parallel:
+            input_args.append([evaluate_per_image, info, working_folder, attribute_field, attr_vals,
+                               chunk_size, num_classes, debug])
+            continue
+        gdf, gpkg_stem = evaluate_per_image(info, working_folder, attribute_field, attr_vals,
+                                            chunk_size, num_classes, debug)
+        gdf_.append(gdf)
+        gpkg_name_.append(gpkg_stem)
+
+    if parallel:
+        # each image's burn + per-tile metrics is independent of the others: farm them out per image
+        processes = min(len(input_args), multiprocessing.cpu_count())
+        logging.info(f'Parallelizing evaluation of {len(input_args)} images over {processes} processes...')
+        with multiprocessing.get_context('spawn').Pool(processes=processes) as pool:
+            for gdf, gpkg_stem in tqdm(pool.imap(map_wrapper, input_args), total=len(input_args),
+                                       position=0, desc='Evaluating from input list'):
+                gdf_.append(gdf)
+                gpkg_name_.append(gpkg_stem)
 
     if not len(gdf_) == len(gpkg_name_):
         raise logging.critical(ValueError('\nbenchmarking unable to complete'))
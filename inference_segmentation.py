@@ -1,4 +1,5 @@
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from math import sqrt
 from typing import List, Union, Sequence
 
@@ -8,10 +9,10 @@ import torch.nn.functional as F
 import numpy as np
 import time
 import fiona  # keep this import. it sets GDAL_DATA to right value
+import geopandas as gpd
 import rasterio
 import ttach as tta
 from collections import OrderedDict
-from fiona.crs import to_string
 from tqdm import tqdm
 from rasterio import features
 from rasterio.windows import Window
@@ -44,61 +45,49 @@ def _pad_diff(arr, w, h, arr_shape):
     return padded_arr
 
 
-def _pad(arr, chunk_size):
-    """ Pads img_arr """
-    aug = int(round(chunk_size * (1 - 1.0 / 2.0)))
+def _half_chunk(chunk_size: int) -> int:
+    """ Half chunk size in pure integer math; keeps the round-half-even behavior the previous
+    float expression round(chunk_size * (1 - 1.0 / 2.0)) had on odd chunk sizes """
+    half = chunk_size >> 1
+    return half + ((chunk_size & 1) & (half & 1))
+
+
+def _pad(arr, pad_width):
+    """ Pads img_arr by pad_width pixels on each side """
     if len(arr.shape) > 2:
-        padded_arr = np.pad(arr, ((aug, aug), (aug, aug), (0, 0)), mode="reflect")
+        padded_arr = np.pad(arr, ((pad_width, pad_width), (pad_width, pad_width), (0, 0)), mode="reflect")
     else:
-        padded_arr = np.pad(arr, ((aug, aug), (aug, aug)), mode="reflect")
+        padded_arr = np.pad(arr, ((pad_width, pad_width), (pad_width, pad_width)), mode="reflect")
 
     return padded_arr
 
 
 def ras2vec(raster_file, output_path):
-    # Create a generic polygon schema for the output vector file
-    i = 0
-    feat_schema = {'geometry': 'Polygon',
-                   'properties': OrderedDict([('value', 'int')])
-                   }
-    class_value_domain = set()
-    out_features = []
-
     print("   - Processing raster file: {}".format(raster_file))
     with rasterio.open(raster_file, 'r') as src:
         raster = src.read(1)
+        crs = src.crs
+        transform = src.transform
     mask = raster != 0
     # Vectorize the polygons
-    polygons = features.shapes(raster, mask, transform=src.transform)
-
-    # Create shapely polygon features
-    for polygon in polygons:
-        feature = {'geometry': {
-            'type': 'Polygon',
-            'coordinates': None},
-            'properties': OrderedDict([('value', 0)])}
-
-        feature['geometry']['coordinates'] = polygon[0]['coordinates']
-        value = int(polygon[1])  # Pixel value of the class (layer)
-        class_value_domain.add(value)
-        feature['properties']['value'] = value
-        i += 1
-        out_features.append(feature)
+    polygons = features.shapes(raster, mask, transform=transform)
+
+    # Load all polygonized features at once; geopandas bulk-writes each class layer through GDAL
+    # in a single transaction, rather than one fiona write call per feature
+    records = [{'geometry': geom, 'properties': {'value': int(value)}} for geom, value in polygons]
+    if not records:  # all-background prediction: nothing to vectorize, write no layers
+        print("")
+        print("Number of features written: 0")
+        return
+    gdf = gpd.GeoDataFrame.from_features(records, crs=crs)
 
     print("   - Writing output vector file: {}".format(output_path))
-    num_layers = list(class_value_domain)  # Number of unique pixel value
-    for num_layer in num_layers:
-        polygons = [feature for feature in out_features if feature['properties']['value'] == num_layer]
-        layer_name = 'vector_' + str(num_layer).rjust(3, '0')
+    i = 0
+    for value, layer_gdf in gdf.groupby('value'):  # one layer per unique pixel value
+        layer_name = 'vector_' + str(value).rjust(3, '0')
         print("   - Writing layer: {}".format(layer_name))
-
-        with fiona.open(output_path, 'w',
-                        crs=to_string(src.crs),
-                        layer=layer_name,
-                        schema=feat_schema,
-                        driver='GPKG') as dest:
-            for polygon in polygons:
-                dest.write(polygon)
+        layer_gdf.to_file(output_path, driver='GPKG', layer=layer_name)
+        i += len(layer_gdf)
     print("")
     print("Number of features written: {}".format(i))
 
@@ -115,6 +104,7 @@ def gen_img_samples(src, chunk_size, step, *band_order):
     Returns: generator object
 
     """
+    pad_width = _half_chunk(chunk_size)  # computed once rather than from floats in every _pad call
     for row in range(0, src.height, step):
         for column in range(0, src.width, step):
             window = Window.from_slices(slice(row, row + chunk_size),
@@ -125,12 +115,12 @@ def gen_img_samples(src, chunk_size, step, *band_order):
                 window_array = reshape_as_image(src.read(window=window))
             if window_array.shape[0] < chunk_size or window_array.shape[1] < chunk_size:
                 window_array = _pad_diff(window_array, window_array.shape[0], window_array.shape[1], chunk_size)
-            window_array = _pad(window_array, chunk_size)
+            window_array = _pad(window_array, pad_width)
 
             yield window_array, row, column
 
 
-@torch.no_grad()
+@torch.inference_mode()
 def segmentation(param,
                  input_image,
                  num_classes: int,
@@ -166,7 +156,7 @@ def segmentation(param,
     print_log = True if logging.level == 20 else False  # 20 is INFO
     pad = chunk_size * 2
     h_padded, w_padded = [side + pad for side in input_image.shape]
-    dist_samples = int(round(chunk_size * (1 - 1.0 / 2.0)))
+    dist_samples = _half_chunk(chunk_size)
 
     model.eval()  # switch to evaluate mode
 
@@ -182,25 +172,27 @@ def segmentation(param,
     total_inf_windows = int(np.ceil(input_image.height / step) * np.ceil(input_image.width / step))
     img_gen = gen_img_samples(src=input_image, chunk_size=chunk_size, step=step)
     single_class_mode = False if num_classes > 1 else True
-    for sub_image, row, col in tqdm(img_gen, position=1, leave=False,
-                    desc=f'Inferring on window slices of size {chunk_size}',
-                    total=total_inf_windows):
-        image_metadata = add_metadata_from_raster_to_sample(sat_img_arr=sub_image,
-                                                            raster_handle=input_image,
-                                                            raster_info={})
-
-        sample['metadata'] = image_metadata
-        totensor_transform = augmentation.compose_transforms(param,
-                                                             dataset="tst",
-                                                             input_space=BGR_to_RGB,
-                                                             scale=scale,
-                                                             aug_type='totensor',
-                                                             print_log=print_log)
-        sample['sat_img'] = sub_image
-        sample = totensor_transform(sample)
-        inputs = sample['sat_img'].unsqueeze_(0)
-        inputs = inputs.to(device)
-        if inputs.shape[1] == 4 and any("module.modelNIR" in s for s in model.state_dict().keys()):
+    # Checked once here: state_dict() rebuilds a full parameter dict on every call, and the model's keys
+    # can't change between windows
+    model_has_nir_head = any("module.modelNIR" in s for s in model.state_dict().keys())
+    batch_size = get_key_def('batch_size', param['inference'], default=8, expected_type=int)
+    staging = None  # pinned host buffer, lazily allocated and reused for every batch
+
+    def infer_batch(batch_lst):
+        """Runs a single forward pass on buffered windows and accumulates predictions in the memmap"""
+        nonlocal staging
+        if device.type == 'cuda':
+            # Stack windows into one persistent pinned buffer: pinning pages is itself a costly driver
+            # call, so it is paid once instead of once per batch, and the copy below runs as async DMA.
+            # Reuse is safe because each call ends with a synchronizing device-to-host transfer.
+            if staging is None:
+                staging = torch.empty((batch_size, *batch_lst[0][0].shape),
+                                      dtype=batch_lst[0][0].dtype, pin_memory=True)
+            inputs = torch.stack([window for window, _, _ in batch_lst], out=staging[:len(batch_lst)])
+        else:
+            inputs = torch.stack([window for window, _, _ in batch_lst])
+        inputs = inputs.to(device, non_blocking=True)
+        if inputs.shape[1] == 4 and model_has_nir_head:
             # Init NIR   TODO: make a proper way to read the NIR channel
             #                  and put an option to be able to give the index of the NIR channel
             inputs_NIR = inputs[:, -1, ...]  # Extract the NIR channel -> [batch size, H, W] since it's only one channel
@@ -218,38 +210,71 @@ def segmentation(param,
             logging.debug(f'Shape of augmented output: {augmented_output.shape}')
             # reverse augmentation for outputs
             deaugmented_output = transformer.deaugment_mask(augmented_output)
-            if single_class_mode:
-                deaugmented_output = deaugmented_output.squeeze(dim=0)
-            else:
-                deaugmented_output = F.softmax(deaugmented_output, dim=1).squeeze(dim=0)
+            if not single_class_mode:
+                deaugmented_output = F.softmax(deaugmented_output, dim=1)
             output_lst.append(deaugmented_output)
-        outputs = torch.stack(output_lst)
+        outputs = torch.stack(output_lst)  # (transforms, batch, classes, height, width)
         outputs = torch.mul(outputs, WINDOW_SPLINE_2D)
         outputs, _ = torch.max(outputs, dim=0)
         if single_class_mode:
             outputs = torch.sigmoid(outputs)
-        outputs = outputs.permute(1, 2, 0)
-        outputs = outputs.reshape(pad, pad, num_classes).cpu().numpy().astype('float16')
-        outputs = outputs[dist_samples:-dist_samples, dist_samples:-dist_samples, :]
-        fp[row:row + chunk_size, col:col + chunk_size, :] = \
-            fp[row:row + chunk_size, col:col + chunk_size, :] + outputs
+        outputs = outputs.permute(0, 2, 3, 1)
+        # cast on device so half precision crosses the bus, rather than copying float32 and downcasting on cpu
+        outputs = outputs.reshape(len(batch_lst), pad, pad, num_classes).to(torch.float16).cpu().numpy()
+        outputs = outputs[:, dist_samples:-dist_samples, dist_samples:-dist_samples, :]
+        for window_output, (_, row, col) in zip(outputs, batch_lst):
+            fp[row:row + chunk_size, col:col + chunk_size, :] = \
+                fp[row:row + chunk_size, col:col + chunk_size, :] + window_output
+
+    # composed once: the transform only depends on loop-invariant parameters, no need to rebuild the
+    # whole transform object stack for every window
+    totensor_transform = augmentation.compose_transforms(param,
+                                                         dataset="tst",
+                                                         input_space=BGR_to_RGB,
+                                                         scale=scale,
+                                                         aug_type='totensor',
+                                                         print_log=print_log)
+    batch_lst = []
+    for sub_image, row, col in tqdm(img_gen, position=1, leave=False,
+                    desc=f'Inferring on window slices of size {chunk_size}',
+                    total=total_inf_windows):
+        image_metadata = add_metadata_from_raster_to_sample(sat_img_arr=sub_image,
+                                                            raster_handle=input_image,
+                                                            raster_info={})
+
+        sample['metadata'] = image_metadata
+        sample['sat_img'] = sub_image
+        sample = totensor_transform(sample)
+        # Buffer windows and run the model on full batches: a forward pass per window underuses the GPU,
+        # with launch overhead dominating compute on small chunk sizes
+        batch_lst.append((sample['sat_img'], row, col))
+        if len(batch_lst) == batch_size:
+            infer_batch(batch_lst)
+            batch_lst = []
+    if batch_lst:  # leftover windows from the last, partial batch
+        infer_batch(batch_lst)
     fp.flush()
     del fp
 
     fp = np.memmap(tp_mem, dtype='float16', mode='r', shape=(h_padded, w_padded, num_classes))
-    pred_img = np.zeros((h_padded, w_padded), dtype=np.uint8)
+    # final prediction array is allocated at the raster's size directly; the padded overhang of each border
+    # chunk is clipped at write time instead of allocating (then slicing away) a padded full-size array
+    h, w = input_image.shape
+    pred_img = np.zeros((h, w), dtype=np.uint8)
     for row, col in tqdm(itertools.product(range(0, input_image.height, step), range(0, input_image.width, step)),
                          leave=False,
                          total=total_inf_windows,
                          desc="Writing to array"):
-        arr1 = fp[row:row + chunk_size, col:col + chunk_size, :] / (2 ** 2)
+        arr1 = fp[row:row + chunk_size, col:col + chunk_size, :]
         if single_class_mode:
-            arr1 = (arr1 > threshold)
+            # the accumulator sums up to 2**2 overlapping windows; instead of dividing every pixel back to
+            # [0, 1], compare against the equivalently scaled threshold (exact: the scale is a power of two)
+            arr1 = (arr1 > threshold * (2 ** 2))
             arr1 = np.squeeze(arr1, axis=2).astype(np.uint8)
         else:
+            # argmax is invariant to the constant 2**2 normalization, so the division pass is skipped
             arr1 = arr1.argmax(axis=-1).astype('uint8')
-        pred_img[row:row + chunk_size, col:col + chunk_size] = arr1
-    pred_img = pred_img[:h_padded-pad, :w_padded-pad]
+        pred_img[row:row + chunk_size, col:col + chunk_size] = arr1[:h - row, :w - col]
     end_seg = time.time() - start_seg
     logging.info('Segmentation operation completed in {:.0f}m {:.0f}s'.format(end_seg // 60, end_seg % 60))
 
@@ -373,6 +398,13 @@ def main(params: Union[DictConfig, dict]) -> None:
                                                 max_pix_per_mb_gpu=max_pix_per_mb_gpu, default=512)
     chunk_size = get_key_def('chunk_size', params['inference'], default=auto_chunk_size, expected_type=int)
     device = set_device(gpu_devices_dict=gpu_devices_dict)
+    if device.type == 'cuda':
+        # Convolution-heavy inference over fixed-shape windows: allow TF32 on tensor cores and let cudnn
+        # autotune its convolution algorithms once for the window shape. Mixed precision itself is handled
+        # by the autocast context in segmentation().
+        torch.backends.cuda.matmul.allow_tf32 = True
+        torch.backends.cudnn.allow_tf32 = True
+        torch.backends.cudnn.benchmark = True
     # Read the concatenation point if requested model is deeplabv3 dualhead
     conc_point = get_key_def('conc_point', params['model'], None)
 
@@ -385,12 +417,26 @@ def main(params: Union[DictConfig, dict]) -> None:
         state_dict_path=state_dict,
     )
 
+    # Optionally compile the model: window shapes are fixed, so kernel fusion pays off over the many
+    # identical forward passes below. Requires torch >= 2.0; falls back to the eager model otherwise.
+    compile_model = get_key_def('compile_model', params['inference'], default=False, expected_type=bool)
+    if compile_model:
+        try:
+            model = torch.compile(model, mode="reduce-overhead")
+            logging.info("Model compiled with torch.compile")
+        except AttributeError:
+            logging.warning("torch.compile is not available in this version of torch. Using model as is.")
+
     # GET LIST OF INPUT IMAGES FOR INFERENCE
     list_img = list_input_images(img_dir_or_csv, glob_patterns=["*.tif", "*.TIF"])
 
     # VALIDATION: anticipate problems with imagery before entering main for loop
-    for info in tqdm(list_img, desc='Validating imagery'):
-        is_valid = validate_input_imagery(info['tif'], num_bands=num_bands, extended=debug)
+    # Validation is I/O bound (rasterio opens, remote header fetches for urls): overlap it with threads
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(list_img)))) as executor:
+        valid_results = list(tqdm(
+            executor.map(lambda info: validate_input_imagery(info['tif'], num_bands=num_bands, extended=debug),
+                         list_img),
+            total=len(list_img), desc='Validating imagery'))
         # TODO: address with issue #310
     logging.info('\nSuccessfully validated imagery')
 
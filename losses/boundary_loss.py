@@ -9,10 +9,11 @@ logging.getLogger(__name__)
 
 def one_hot(label, n_classes, requires_grad=True):
     """Return One Hot Label"""
-    device = label.device
-    one_hot_label = torch.eye(
-        n_classes, device=device, requires_grad=requires_grad)[label]
-    one_hot_label = one_hot_label.transpose(1, 3).transpose(2, 3)
+    # F.one_hot encodes in a single fused kernel, rather than materializing an identity matrix
+    # and gathering rows from it. No gradient flows to an integer label, requires_grad kept for api compat.
+    # Labels may contain ignore_index (-1) pixels (ex.: rotation fill with duo loss); F.one_hot rejects
+    # negative values, so wrap them the way the old eye-gather did (-1 encoded as the last class).
+    one_hot_label = F.one_hot(label % n_classes, n_classes).permute(0, 3, 1, 2).float()
 
     return one_hot_label
 
@@ -1,3 +1,4 @@
+import multiprocessing
 import shutil
 from typing import Sequence
 
@@ -8,13 +9,13 @@ from pathlib import Path
 from datetime import datetime
 from omegaconf import DictConfig, open_dict
 
-from dataset.aoi import aois_from_csv
+from dataset.aoi import aois_from_csv, AOI
 from utils.logger import get_logger
 from utils.geoutils import vector_to_raster
 from utils.readers import image_reader_as_array
-from utils.create_dataset import create_files_and_datasets, append_to_dataset
+from utils.create_dataset import create_files_and_datasets, append_to_dataset, flush_samples_buffer
 from utils.utils import (
-    get_key_def, pad, pad_diff, add_metadata_from_raster_to_sample, get_git_hash,
+    get_key_def, pad, pad_diff, add_metadata_from_raster_to_sample, get_git_hash, map_wrapper,
 )
 
 # Set the logging file
@@ -76,11 +77,14 @@ def class_proportion(target, sample_size: int, class_min_prop: dict):
     if not class_min_prop:
         return True
     sample_total = sample_size ** 2
+    # scan the tile once: the previous version recomputed unique values and a full bincount for every class key
+    target_classes = np.unique(target)
+    target_counts = np.bincount(target.clip(min=0).flatten())
     for key, value in class_min_prop.items():
-        if key not in np.unique(target):
+        if key not in target_classes:
             target_prop_classwise = 0
         else:
-            target_prop_classwise = (round((np.bincount(target.clip(min=0).flatten())[key] / sample_total) * 100, 1))
+            target_prop_classwise = (round((target_counts[key] / sample_total) * 100, 1))
         if target_prop_classwise < value:
             return False
     return True
@@ -95,33 +99,36 @@ def add_to_datasets(dataset,
                     sample_metadata,
                     metadata_idx,
                     dict_classes,
+                    samples_buffer,
+                    val_buffer,
+                    random_val=None,
                     stratification_bias=0,
                     stratification_dict=None):
-    """ Add sample to Hdf5 (trn, val or tst) and computes pixel classes(%). """
+    """ Buffer sample for Hdf5 writing (trn, val or tst) and computes pixel classes(%). """
     to_val_set = False
+    buffer = samples_buffer
     if dataset == 'trn':
-        random_val = np.random.randint(1, 100)
+        if random_val is None:
+            random_val = np.random.randint(1, 100)
         if random_val > val_percent + stratification_bias:
             if stratification_dict is not None:
                 stratification_dict['latest_assignment'] = 'trn'
         else:
             to_val_set = True
-            samples_file = val_sample_file
+            buffer = val_buffer
             if stratification_dict is not None:
                 stratification_dict['latest_assignment'] = 'val'
-    append_to_dataset(samples_file["sat_img"], data)
-    append_to_dataset(samples_file["map_img"], target)
-    append_to_dataset(samples_file["sample_metadata"], repr(sample_metadata))
-    append_to_dataset(samples_file["meta_idx"], metadata_idx)
+    buffer.append((data, target, repr(sample_metadata), metadata_idx))
 
     # adds pixel count to pixel_classes dict for each class in the image
     class_vals, counts = np.unique(target, return_counts=True)
-    for i in range(len(class_vals)):
-        class_val = class_vals[i]
-        count = counts[i]
-        dict_classes[class_val] += count
-        if class_val not in dict_classes.keys():
+    # tolist() converts both arrays to python scalars in one C call, rather than extracting (and boxing)
+    # one numpy scalar per index inside the loop
+    for class_val, count in zip(class_vals.tolist(), counts.tolist()):
+        if class_val not in dict_classes:
             logging.error(f'Sample contains value "{class_val}" not defined in the classes ({dict_classes.keys()}).')
+            continue
+        dict_classes[class_val] += count
     return to_val_set
 
 
@@ -184,12 +191,21 @@ def samples_preparation(in_img_array,
     added_samples = 0
     excl_samples = 0
 
+    # Kept samples are buffered in memory, then written once per raster: appending them one by one
+    # costs an hdf5 dataset resize per sample, which is slow on large datasets and network filesystems.
+    samples_buffer = []
+    val_buffer = []
+
+    # Draw the train/val split randoms for the whole grid in one vectorized call, rather than paying numpy's
+    # scalar-draw overhead once per kept sample inside the loop
+    random_vals = np.random.randint(1, 100, size=(len(range(0, h, dist_samples)), len(range(0, w, dist_samples))))
+
     # with tqdm(range(0, h, dist_samples), position=1, leave=True,
     #           desc=f'Writing samples. Dataset currently contains {idx_samples} '
     #                f'samples') as _tqdm:
     with tqdm(range(0, h, dist_samples), position=1, leave=True) as _tqdm:
-        for row in _tqdm:
-            for column in range(0, w, dist_samples):
+        for row_idx, row in enumerate(_tqdm):
+            for col_idx, column in enumerate(range(0, w, dist_samples)):
                 data = (in_img_array[row:row + sample_size, column:column + sample_size, :])
                 target = np.squeeze(label_array[row:row + sample_size, column:column + sample_size, :], axis=2)
                 data_row = data.shape[0]
@@ -207,8 +223,7 @@ def samples_preparation(in_img_array,
                     padding = pad_diff(target_row, target_col, sample_size,
                                        sample_size)  # array, actual height, actual width, desired size
                     target = pad(target, padding, fill=dontcare)
-                backgr_ct = np.sum(target == 0)
-                backgr_ct += np.sum(target == dontcare)
+                backgr_ct = np.count_nonzero((target == 0) | (target == dontcare))
                 target_background_percent = round(backgr_ct / target.size * 100, 1)
 
                 sample_metadata = {'sample_indices': (row, column)}
@@ -257,6 +272,9 @@ def samples_preparation(in_img_array,
                                           sample_metadata=sample_metadata,
                                           metadata_idx=metadata_idx,
                                           dict_classes=pixel_classes,
+                                          samples_buffer=samples_buffer,
+                                          val_buffer=val_buffer,
+                                          random_val=random_vals[row_idx, col_idx],
                                           stratification_bias=stratification_bias,
                                           stratification_dict=stratd)
                     if val:
@@ -284,6 +302,9 @@ def samples_preparation(in_img_array,
                               f'Excld samps={excl_samples}/{len(_tqdm) * len(range(0, w, dist_samples))}, '
                               f'Target annot perc={100 - target_background_percent:.1f}')
 
+    flush_samples_buffer(samples_file, samples_buffer)
+    flush_samples_buffer(val_sample_file, val_buffer)
+
     if added_samples == 0:
         logging.warning(f"No sample added for current raster. Problems may occur with use of metadata")
     if dataset == 'tst':
@@ -295,6 +316,112 @@ def samples_preparation(in_img_array,
     return samples_count, num_classes
 
 
+def append_aoi_samples(aoi: AOI,
+                       prepared: tuple,
+                       samples_size: int,
+                       overlap: int,
+                       number_samples: dict,
+                       number_classes: int,
+                       trn_hdf5,
+                       val_hdf5,
+                       tst_hdf5,
+                       val_percent: int,
+                       pixel_classes: dict,
+                       dontcare: int,
+                       min_annot_perc: int,
+                       class_prop: dict,
+                       stratd: dict):
+    """Writes prepared imagery and label arrays of a single AOI to the output hdf5 datasets (parent process only)."""
+    np_input_image, np_label_raster, metadata = prepared
+    if aoi.split == 'trn':
+        out_file = trn_hdf5
+    elif aoi.split == 'tst':
+        out_file = tst_hdf5
+    else:
+        raise ValueError(f"\nDataset value must be trn or tst. Provided value is {aoi.split}")
+    val_file = val_hdf5
+
+    number_samples, number_classes = samples_preparation(in_img_array=np_input_image,
+                                                         label_array=np_label_raster,
+                                                         sample_size=samples_size,
+                                                         overlap=overlap,
+                                                         samples_count=number_samples,
+                                                         num_classes=number_classes,
+                                                         samples_file=out_file,
+                                                         val_percent=val_percent,
+                                                         val_sample_file=val_file,
+                                                         dataset=aoi.split,
+                                                         pixel_classes=pixel_classes,
+                                                         dontcare=dontcare,
+                                                         image_metadata=metadata,
+                                                         min_annot_perc=min_annot_perc,
+                                                         class_prop=class_prop,
+                                                         stratd=stratd)
+    # logging.info(f'\nNumber of samples={number_samples}')
+    out_file.flush()
+    return number_samples, number_classes
+
+
+def read_and_burn_aoi(
+        aoi: AOI,
+        attribute_field: str,
+        attr_vals: Sequence,
+        background_val: int,
+        dontcare: int):
+    """
+    Reads an AOI's imagery as array and burns its ground truth vector file to a raster of matching shape.
+    This is the CPU-heavy, embarrassingly parallel part of sample preparation; hdf5 writing stays in the parent process.
+    :param aoi: AOI object referencing imagery and ground truth to read
+    :param attribute_field: name of the attribute field used to filter features
+    :param attr_vals: list of attribute values for features to keep
+    :param background_val: background value used when burning vector file
+    :param dontcare: Value in gpkg features that will be ignored during training
+    :return: tuple of (imagery array, burned label array, metadata dict) or None if no vector features were found
+             or the raster could not be read
+    """
+    # OSError is caught here rather than at the caller: a worker exception would otherwise surface from
+    # pool.imap() in the parent and abort the whole run, while serial mode logs and skips.
+    try:
+        aoi.raster_read()  # in case of multiprocessing
+        logging.info(f"\nReading as array: {aoi.raster.name}")
+        with _check_rasterio_im_load(aoi.raster) as raster:
+            # 1. Read the input raster image
+            np_input_image, raster, dataset_nodata = image_reader_as_array(input_image=raster)
+
+            # 2. Burn vector file in a raster file
+            logging.info(f"\nRasterizing vector file (attribute: {attribute_field}): {aoi.label}")
+            try:
+                # ground truth features were already loaded to the AOI's GeoDataFrame at init: burn those directly
+                np_label_raster = vector_to_raster(vector_file=aoi.label_gdf,
+                                                   input_image=raster,
+                                                   out_shape=np_input_image.shape[:2],
+                                                   attribute_name=attribute_field,
+                                                   fill=background_val,
+                                                   attribute_values=attr_vals)  # background value in rasterized vector.
+            except ValueError:
+                logging.error(f"No vector features found for {aoi.label} with provided configuration."
+                              f"Will skip to next AOI.")
+                return None
+
+            if dataset_nodata is not None:
+                # 3. Set ignore_index value in label array where nodata in raster (only if nodata across all bands)
+                np_label_raster[dataset_nodata] = dontcare
+
+            metadata = add_metadata_from_raster_to_sample(sat_img_arr=np_input_image,
+                                                          raster_handle=raster)
+    except OSError:
+        logging.exception(f'\nAn error occurred while preparing samples with "{aoi.aoi_id}" (tiff) and '
+                          f'{Path(aoi.label).stem} (gpkg).')
+        return None
+    # Save label's per class pixel count to image metadata
+    metadata['source_label_bincount'] = {class_num: count for class_num, count in
+                                         enumerate(np.bincount(np_label_raster.clip(min=0).flatten()))
+                                         if count > 0}  # TODO: add this to add_metadata_from[...] function?
+
+    np_label_raster = np.reshape(np_label_raster, (np_label_raster.shape[0], np_label_raster.shape[1], 1))
+    return np_input_image, np_label_raster, metadata
+
+
 def main(cfg: DictConfig) -> None:
     """
     Function that create training, validation and testing datasets preparation.
@@ -379,6 +506,7 @@ def main(cfg: DictConfig) -> None:
                 raise logging.critical(ValueError(f'\nAttribute value "{item}" is {type(item)}, expected int.'))
 
     # OPTIONAL
+    parallel = get_key_def('multiprocessing', cfg['dataset'], default=False, expected_type=bool)
     use_stratification = cfg.dataset.use_stratification if cfg.dataset.use_stratification is not None else False
     if use_stratification:
         stratd = {
@@ -397,7 +525,8 @@ def main(cfg: DictConfig) -> None:
         csv_path=csv_file,
         bands_requested=bands_requested,
         attr_field_filter=attribute_field,
-        attr_values_filter=attr_vals
+        attr_values_filter=attr_vals,
+        for_multiprocessing=parallel,
     )
 
     # IF DEBUG IS ACTIVATE
@@ -433,72 +562,48 @@ def main(cfg: DictConfig) -> None:
         f"\nPreparing samples \n  Samples_size: {samples_size} \n  Overlap: {overlap} "
         f"\n  Validation set: {val_percent} % of created training samples"
     )
+    input_args = []
+    parallel_aois = []
     for aoi in tqdm(list_data_prep, position=0, leave=False):
         try:
-            logging.info(f"\nReading as array: {aoi.raster.name}")
-            with _check_rasterio_im_load(aoi.raster) as raster:
-                # 1. Read the input raster image
-                np_input_image, raster, dataset_nodata = image_reader_as_array(input_image=raster)
-
-                # 2. Burn vector file in a raster file
-                logging.info(f"\nRasterizing vector file (attribute: {attribute_field}): {aoi.label}")
-                try:
-                    np_label_raster = vector_to_raster(vector_file=aoi.label,
-                                                       input_image=raster,
-                                                       out_shape=np_input_image.shape[:2],
-                                                       attribute_name=attribute_field,
-                                                       fill=background_val,
-                                                       attribute_values=attr_vals)  # background value in rasterized vector.
-                except ValueError:
-                    logging.error(f"No vector features found for {aoi.label} with provided configuration."
-                                  f"Will skip to next AOI.")
-                    continue
-
-                if dataset_nodata is not None:
-                    # 3. Set ignore_index value in label array where nodata in raster (only if nodata across all bands)
-                    np_label_raster[dataset_nodata] = dontcare
-
-            if aoi.split == 'trn':
-                out_file = trn_hdf5
-            elif aoi.split == 'tst':
-                out_file = tst_hdf5
-            else:
-                raise ValueError(f"\nDataset value must be trn or tst. Provided value is {aoi.split}")
-            val_file = val_hdf5
-
-            metadata = add_metadata_from_raster_to_sample(sat_img_arr=np_input_image,
-                                                          raster_handle=raster)
-            # Save label's per class pixel count to image metadata
-            metadata['source_label_bincount'] = {class_num: count for class_num, count in
-                                                 enumerate(np.bincount(np_label_raster.clip(min=0).flatten()))
-                                                 if count > 0}  # TODO: add this to add_metadata_from[...] function?
-
-            np_label_raster = np.reshape(np_label_raster, (np_label_raster.shape[0], np_label_raster.shape[1], 1))
+            if parallel:
+                # CPU-heavy read and rasterization is farmed out below; hdf5 writes stay in this process
+                input_args.append([read_and_burn_aoi, aoi, attribute_field, attr_vals, background_val, dontcare])
+                parallel_aois.append(aoi)
+                continue
+            prepared = read_and_burn_aoi(aoi, attribute_field, attr_vals, background_val, dontcare)
+            if prepared is None:
+                continue
             # 3. Prepare samples!
-            number_samples, number_classes = samples_preparation(in_img_array=np_input_image,
-                                                                 label_array=np_label_raster,
-                                                                 sample_size=samples_size,
-                                                                 overlap=overlap,
-                                                                 samples_count=number_samples,
-                                                                 num_classes=number_classes,
-                                                                 samples_file=out_file,
-                                                                 val_percent=val_percent,
-                                                                 val_sample_file=val_file,
-                                                                 dataset=aoi.split,
-                                                                 pixel_classes=pixel_classes,
-                                                                 dontcare=dontcare,
-                                                                 image_metadata=metadata,
-                                                                 min_annot_perc=min_annot_perc,
-                                                                 class_prop=class_prop,
-                                                                 stratd=stratd)
-
-            # logging.info(f'\nNumber of samples={number_samples}')
-            out_file.flush()
+            number_samples, number_classes = append_aoi_samples(aoi, prepared, samples_size, overlap,
+                                                                number_samples, number_classes,
+                                                                trn_hdf5, val_hdf5, tst_hdf5, val_percent,
+                                                                pixel_classes, dontcare, min_annot_perc,
+                                                                class_prop, stratd)
         except OSError:
-            logging.exception(f'\nAn error occurred while preparing samples with "{Path(aoi.raster.name).stem}" (tiff) and '
+            logging.exception(f'\nAn error occurred while preparing samples with "{aoi.aoi_id}" (tiff) and '
                               f'{Path(aoi.label).stem} (gpkg).')
             continue
 
+    if parallel:
+        processes = min(len(input_args), multiprocessing.cpu_count())
+        logging.info(f'Parallelizing imagery read and ground truth rasterization for {len(input_args)} aois '
+                     f'over {processes} processes...')
+        with multiprocessing.get_context('spawn').Pool(processes=processes) as pool:
+            for aoi, prepared in zip(parallel_aois, pool.imap(map_wrapper, input_args)):
+                try:
+                    if prepared is None:
+                        continue
+                    number_samples, number_classes = append_aoi_samples(aoi, prepared, samples_size, overlap,
+                                                                        number_samples, number_classes,
+                                                                        trn_hdf5, val_hdf5, tst_hdf5, val_percent,
+                                                                        pixel_classes, dontcare, min_annot_perc,
+                                                                        class_prop, stratd)
+                except OSError:
+                    logging.exception(f'\nAn error occurred while preparing samples with "{aoi.aoi_id}" (tiff) and '
+                                      f'{Path(aoi.label).stem} (gpkg).')
+                    continue
+
     trn_hdf5.close()
     val_hdf5.close()
     tst_hdf5.close()
@@ -146,23 +146,18 @@ class RadiometricTrim(object):
         # Loop through bands
         for band_idx in range(sample['sat_img'].shape[2]):
             band = sample['sat_img'][:, :, band_idx]
-            band_histogram = sample['metadata']['source_raster_bincount'][f'band{band_idx}']
+            band_histogram = np.fromiter(sample['metadata']['source_raster_bincount'][f'band{band_idx}'],
+                                         dtype=np.int64)
             # Determine what is the index of nonzero pixel corresponding to left and right trim percentile
-            sum_nonzero_pix_per_band = sum(band_histogram)
+            sum_nonzero_pix_per_band = int(band_histogram.sum())
             left_pixel_idx = round(sum_nonzero_pix_per_band / 100 * trim)
             right_pixel_idx = round(sum_nonzero_pix_per_band / 100 * (100-trim))
-            cumulative_pixel_count = 0
-            # TODO: can this for loop be optimized? Also, this hasn't been tested with non 8-bit data. Should be fine though.
-            # Loop through pixel values of given histogram
-            for pixel_val, count_per_pix_val in enumerate(band_histogram):
-                lower_limit = cumulative_pixel_count
-                upper_limit = cumulative_pixel_count + count_per_pix_val
-                # Check if left and right pixel indices are contained in current lower and upper pixels count limits
-                if lower_limit <= left_pixel_idx <= upper_limit:
-                    left_pix_val = pixel_val
-                if lower_limit <= right_pixel_idx <= upper_limit:
-                    right_pix_val = pixel_val
-                cumulative_pixel_count += count_per_pix_val
+            # The trim value for a wanted pixel index is the last histogram bucket whose cumulative count of
+            # lower pixel values doesn't exceed that index: a binary search over the cumulative histogram
+            # replaces the former python loop over every bucket. Not tested with non 8-bit data. Should be fine though.
+            cumulative_count_below = np.concatenate(([0], np.cumsum(band_histogram)[:-1]))
+            left_pix_val = int(np.searchsorted(cumulative_count_below, left_pixel_idx, side='right')) - 1
+            right_pix_val = int(np.searchsorted(cumulative_count_below, right_pixel_idx, side='right')) - 1
             # Enhance using above left and right pixel values as in_range
             rescaled_band = exposure.rescale_intensity(band, in_range=(left_pix_val, right_pix_val), out_range=out_dtype)
             # Write each enhanced band to empty array
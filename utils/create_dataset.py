@@ -29,6 +29,35 @@ def append_to_dataset(dataset, sample):
     return old_size
 
 
+def append_many_to_dataset(dataset, samples: list):
+    """
+    Append a batch of samples to a provided dataset with a single resize, rather than one resize per sample.
+    :param dataset:
+    :param samples: list of data to append
+    :return: Index of the first appended sample.
+    """
+    old_size = dataset.shape[0]  # this function always appends samples on the first axis
+    if not samples:
+        return old_size
+    dataset.resize(old_size + len(samples), axis=0)
+    for index, sample in enumerate(samples):
+        dataset[old_size + index, ...] = sample
+    return old_size
+
+
+def flush_samples_buffer(samples_file, buffer: list):
+    """
+    Append buffered (data, target, sample_metadata, metadata_idx) samples to the hdf5 file in one batch.
+    :param samples_file: (hdf5 dataset) hdf5 file where samples will be written
+    :param buffer: list of samples as buffered by add_to_datasets(). Emptied once written.
+    """
+    append_many_to_dataset(samples_file["sat_img"], [sample[0] for sample in buffer])
+    append_many_to_dataset(samples_file["map_img"], [sample[1] for sample in buffer])
+    append_many_to_dataset(samples_file["sample_metadata"], [sample[2] for sample in buffer])
+    append_many_to_dataset(samples_file["meta_idx"], [sample[3] for sample in buffer])
+    buffer.clear()
+
+
 def create_files_and_datasets(samples_size: int, number_of_bands: int, samples_folder: Path, cfg: DictConfig):
     """
     Function to create the hdfs files (trn, val and tst).
@@ -82,6 +111,7 @@ class SegmentationDataset(Dataset):
         self.totensor_transform = totensor_transform
         self.debug = debug
         self.hdf5_path = os.path.join(self.work_folder, self.dataset_type + "_samples.hdf5")
+        self.hdf5_file = None  # opened lazily in __getitem__, once per (worker) process
         with h5py.File(self.hdf5_path, "r") as hdf5_file:
             for i in range(hdf5_file["metadata"].shape[0]):
                 metadata = hdf5_file["metadata"][i, ...]
@@ -96,23 +126,27 @@ class SegmentationDataset(Dataset):
         return self.max_sample_count
 
     def __getitem__(self, index):
-        with h5py.File(self.hdf5_path, "r") as hdf5_file:
-            sat_img = np.float32(hdf5_file["sat_img"][index, ...])
-            assert self.num_bands <= sat_img.shape[-1]
-            map_img = hdf5_file["map_img"][index, ...]
-            meta_idx = int(hdf5_file["meta_idx"][index])
-            metadata = self.metadata[meta_idx]
-            sample_metadata = hdf5_file["sample_metadata"][index, ...][0]
-            sample_metadata = eval(sample_metadata)
-            if isinstance(metadata, np.ndarray) and len(metadata) == 1:
-                metadata = metadata[0]
-            elif isinstance(metadata, bytes):
-                metadata = metadata.decode('UTF-8')
-            try:
-                metadata = eval(metadata)
-                metadata.update(sample_metadata)
-            except TypeError:
-                pass
+        # Open the hdf5 file on first access rather than once per sample: each dataloader worker thus keeps its
+        # own handle (and h5py chunk cache) alive for the epoch, and handles are never shared across processes.
+        if self.hdf5_file is None:
+            self.hdf5_file = h5py.File(self.hdf5_path, "r")
+        hdf5_file = self.hdf5_file
+        sat_img = np.float32(hdf5_file["sat_img"][index, ...])
+        assert self.num_bands <= sat_img.shape[-1]
+        map_img = hdf5_file["map_img"][index, ...]
+        meta_idx = int(hdf5_file["meta_idx"][index])
+        metadata = self.metadata[meta_idx]
+        sample_metadata = hdf5_file["sample_metadata"][index, ...][0]
+        sample_metadata = eval(sample_metadata)
+        if isinstance(metadata, np.ndarray) and len(metadata) == 1:
+            metadata = metadata[0]
+        elif isinstance(metadata, bytes):
+            metadata = metadata.decode('UTF-8')
+        try:
+            metadata = eval(metadata)
+            metadata.update(sample_metadata)
+        except TypeError:
+            pass
 
         sample = {"sat_img": sat_img, "map_img": map_img, "metadata": metadata,
                   "hdf5_path": self.hdf5_path}
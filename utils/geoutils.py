@@ -5,6 +5,7 @@ import numpy as np
 
 import fiona
 
+import geopandas as gpd
 import pystac
 import rasterio
 from rasterio import MemoryFile
@@ -46,7 +47,7 @@ def lst_ids(list_vector, attr_name, target_ids=None, merge_all=True):
 def vector_to_raster(vector_file, input_image, out_shape, attribute_name, fill=0, attribute_values=None, merge_all=True):
     """Function to rasterize vector data.
     Args:
-        vector_file: Path and name of reference GeoPackage
+        vector_file: Path and name of reference GeoPackage, or an already loaded GeoDataFrame of its features
         input_image: Rasterio file handle holding the (already opened) input raster
         attribute_name: Attribute containing the identifier for a vector (may contain slashes if recursive)
         fill: default background value to use when filling non-contiguous regions
@@ -57,9 +58,15 @@ def vector_to_raster(vector_file, input_image, out_shape, attribute_name, fill=0
     Return:
         numpy array of the burned image
     """
-    # Extract vector features to burn in the raster image
-    with fiona.open(vector_file, 'r') as src:
-        lst_vector = [vector for vector in src]
+    # Extract vector features to burn in the raster image. If the caller already holds the features in memory
+    # (ex.: AOI objects load their ground truth at init), reuse them rather than reading the file a second time.
+    if isinstance(vector_file, gpd.GeoDataFrame):
+        lst_vector = list(vector_file.iterfeatures())
+    else:
+        # The bbox filter goes through the vector file's spatial index: features entirely outside the raster's
+        # extent cannot be burned and are never fetched.
+        with fiona.open(vector_file, 'r') as src:
+            lst_vector = list(src.filter(bbox=tuple(input_image.bounds)))
 
     # Sort feature in order to priorize the burning in the raster image (ex: vegetation before roads...)
     if attribute_name is not None:
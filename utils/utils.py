@@ -1,6 +1,8 @@
 import csv
+import fnmatch
 import logging
 import numbers
+import os
 import subprocess
 from functools import reduce
 from pathlib import Path
@@ -338,14 +340,28 @@ def list_input_images(img_dir_or_csv: Path,
         if not img_dir.is_dir():
             raise NotADirectoryError(f'Could not find directory/file "{img_dir_or_csv}"')
 
-        list_img_paths = set()
-        if img_dir.is_dir():
-            for glob_pattern in glob_patterns:
-                if not isinstance(glob_pattern, str):
-                    raise TypeError(f'Invalid glob pattern: "{glob_pattern}"')
-                list_img_paths.update(sorted(img_dir.glob(glob_pattern)))
-        else:
-            list_img_paths.update([img_dir])
+        for glob_pattern in glob_patterns:
+            if not isinstance(glob_pattern, str):
+                raise TypeError(f'Invalid glob pattern: "{glob_pattern}"')
+        # Single scandir pass rather than one Path.glob() walk per pattern: globbing fnmatches and stats every
+        # entry, which dominates runtime on directories containing thousands of images. Plain "*suffix"
+        # patterns reduce to a cheap endswith; anything else keeps glob semantics through fnmatch.
+        suffixes = []
+        fnmatch_patterns = []
+        for glob_pattern in glob_patterns:
+            stripped = glob_pattern.lstrip('*')
+            if any(wildcard in stripped for wildcard in '*?['):
+                fnmatch_patterns.append(glob_pattern)
+            else:
+                suffixes.append(stripped)
+        suffixes = tuple(suffixes)  # str.endswith() with an empty tuple matches nothing
+        with os.scandir(img_dir) as entries:
+            list_img_paths = sorted(
+                Path(entry.path) for entry in entries
+                if (entry.name.endswith(suffixes)
+                    or any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in fnmatch_patterns))
+                and entry.is_file(follow_symlinks=False)
+            )
         list_img = []
         for img_path in list_img_paths:
             img = {'tif': img_path}
@@ -415,7 +431,8 @@ def add_metadata_from_raster_to_sample(sat_img_arr: np.ndarray,
     assert isinstance(sat_img_arr, np.ndarray) and len(sat_img_arr.shape) == 3, f"Array should be 3-dimensional"
     for band_index in range(sat_img_arr.shape[2]):
         band = sat_img_arr[..., band_index]
-        metadata_dict['source_raster_bincount'][f'band{band_index}'] = {count for count in np.bincount(band.flatten())}
+        # bucket order matters to consumers (ex.: RadiometricTrim's percentile search over the cumulative counts)
+        metadata_dict['source_raster_bincount'][f'band{band_index}'] = np.bincount(band.flatten()).tolist()
     return metadata_dict
 
 #### Image Patches Smoothing Functions ####
@@ -467,8 +484,9 @@ def get_git_hash():
     found with the following url: https://github.com/<owner>/<project>/commit/<hash>, aka
     https://github.com/NRCan/geo-deep-learning/commit/<hash>
     """
-    command = f'git rev-parse --short HEAD'
-    subproc = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # argument list runs git directly, without forking an intermediate shell
+    command = ['git', 'rev-parse', '--short', 'HEAD']
+    subproc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     git_hash = str(subproc.stdout, "utf-8").replace("\n", "")
     # when code not executed from git repo, subprocess outputs return code #128. This has been tested.
     # Reference: https://stackoverflow.com/questions/58575970/subprocess-call-with-exit-status-128
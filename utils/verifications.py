@@ -1,3 +1,4 @@
+import functools
 import os
 from pathlib import Path
 from typing import Union, List
@@ -18,6 +19,21 @@ from utils.utils import is_url
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=128)
+def _cached_rasterio_open(raster_path: str) -> rasterio.DatasetReader:
+    """Opens a raster and caches the handle per path: validation steps are commonly chained over the same
+    files and every open re-parses metadata (a remote request for url-based imagery). Keeps up to 128
+    handles (and their file descriptors) alive for the process lifetime."""
+    return _check_rasterio_im_load(raster_path)
+
+
+def _rasterio_load(raster: Union[str, Path, rasterio.DatasetReader]) -> rasterio.DatasetReader:
+    """Resolves a raster input to an open rasterio dataset, through the per-path cache for str/Path inputs"""
+    if isinstance(raster, (str, Path)):
+        return _cached_rasterio_open(str(raster))
+    return _check_rasterio_im_load(raster)
+
+
 def validate_raster(raster: Union[str, Path, rasterio.DatasetReader], extended: bool = False) -> None:
     """
     Checks if raster is valid, i.e. not corrupted (based on metadata, or actual byte info if under size threshold)
@@ -28,15 +44,17 @@ def validate_raster(raster: Union[str, Path, rasterio.DatasetReader], extended:
     if not raster:
         raise FileNotFoundError(f"No raster provided. Got: {raster}")
     try:
-        raster = _check_rasterio_im_load(raster)
+        raster = _rasterio_load(raster)
     except (TypeError, ValueError) as e:
         logging.critical(f"Invalid raster.\nRaster path: {raster}\n{e}")
         raise e
     try:
-        size = Path(raster.name).stat().st_size if not is_url(raster.name) else None
-        logging.debug(f'Raster to validate: {raster}\n'
-                      f'Size: {size}\n'
-                      f'Extended check: {extended}')
+        # Size is only logged: don't pay for the stat syscall on every raster unless debug logging is on
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            size = Path(raster.name).stat().st_size if not is_url(raster.name) else None
+            logging.debug(f'Raster to validate: {raster}\n'
+                          f'Size: {size}\n'
+                          f'Extended check: {extended}')
         if not raster.meta['dtype'] in ['uint8', 'uint16']:  # will trigger exception if invalid raster
             logging.warning(f"Only uint8 and uint16 are supported in current version.\n"
                             f"Datatype {raster.meta['dtype']} for {raster.aoi_id} may cause problems.")
@@ -55,14 +73,14 @@ def validate_raster(raster: Union[str, Path, rasterio.DatasetReader], extended:
         raise e
 
 
-def validate_num_bands(raster_path: Union[str, Path], num_bands: int) -> None:
+def validate_num_bands(raster_path: Union[str, Path, rasterio.DatasetReader], num_bands: int) -> None:
     """
     Checks match between expected and actual number of bands
     @param raster_path: Path to raster to be validated
     @param num_bands: Number of bands expected
     @return: if expected and actual number of bands match, returns True, else False (with logging.critical)
     """
-    raster = _check_rasterio_im_load(raster_path)
+    raster = _rasterio_load(raster_path)
     input_band_count = raster.meta['count']
     if not input_band_count == num_bands:
         logging.critical(f"The number of bands expected doesn't match number of bands in input image.\n"
@@ -72,6 +90,39 @@ def validate_num_bands(raster_path: Union[str, Path], num_bands: int) -> None:
         raise ValueError()
 
 
+def validate_num_classes(
+        vector_file: Union[str, Path, gpd.GeoDataFrame],
+        num_classes: int,
+        attribute_name: str,
+        ignore_index: int = None,
+        attribute_values: List = None) -> None:
+    """
+    Check that `num_classes` matches the number of classes detected in the specified attribute of a vector file
+    @param vector_file: Path to ground truth file or already loaded GeoDataFrame
+    @param num_classes: Number of classes expected
+    @param attribute_name: Name of the value field representing the required classes (may contain slashes if recursive)
+    @param ignore_index: Optional, value that should not be counted as a class
+    @param attribute_values: Optional, attribute values for features to keep
+    @return: if detected and expected number of classes match, returns None, else raises ValueError
+    """
+    label_gdf = _check_gdf_load(vector_file)
+    # fiona and geopandas don't expect attribute name exactly the same way: "properties/class" vs "class"
+    attribute_name = attribute_name.split('/')[-1]
+    if attribute_name not in label_gdf.columns:
+        raise ValueError(f"Attribute \"{attribute_name}\" not found in label attributes: {label_gdf.columns}")
+    # one vectorized pass over the attribute column, rather than a recursive dict walk per feature
+    unique_att_vals = set(np.unique(label_gdf[attribute_name].to_numpy().astype(int)).tolist())
+    if attribute_values:
+        unique_att_vals = unique_att_vals.intersection(set(attribute_values))
+    unique_att_vals.discard(ignore_index)
+    if len(unique_att_vals) != num_classes:
+        logging.error(f"The number of classes expected doesn't match the number of classes detected in ground truth.\n"
+                      f"Expected: {num_classes} classes\n"
+                      f"Got: {len(unique_att_vals)} classes ({sorted(unique_att_vals)})\n"
+                      f"Ground truth: {vector_file}")
+        raise ValueError()
+
+
 def validate_input_imagery(raster_path: Union[str, Path], num_bands: int, extended: bool = False) -> bool:
     """
     Validates raster and checks match between expected and actual number of bands
@@ -81,11 +132,13 @@ def validate_input_imagery(raster_path: Union[str, Path], num_bands: int, extend
     @return:
     """
     try:
-        validate_raster(raster_path, extended)
+        # open once and hand the same handle to both checks below: they accept an open rasterio dataset
+        raster = _rasterio_load(raster_path)
+        validate_raster(raster, extended)
     except Exception as e:  # TODO: address with issue #310
         return False
     try:
-        validate_num_bands(raster_path, num_bands)
+        validate_num_bands(raster, num_bands)
     except Exception as e:
         return False
     return True
@@ -99,7 +152,7 @@ def assert_crs_match(
     :param raster: (str or Path) path to raster file
     :param label: (str or Path) path to gpkg file
     """
-    raster = _check_rasterio_im_load(raster)
+    raster = _rasterio_load(raster)
     raster_crs = raster.crs
     gt = _check_gdf_load(label)
     gt_crs = gt.crs
@@ -132,5 +185,7 @@ def validate_features_from_gpkg(label: Union[str, Path, gpd.GeoDataFrame], attri
     :param attribute_name: name of the value field representing the required classes in the vector image file
     """
     label_gdf = _check_gdf_load(label)
-    invalid_features = list(np.where(label_gdf.is_valid != True)[0])
+    # one GEOS batch call over the whole geometry column; empty geometries can't be burned either
+    invalid_mask = ~label_gdf.is_valid | label_gdf.is_empty
+    invalid_features = np.flatnonzero(invalid_mask.to_numpy()).tolist()
     return invalid_features
@@ -150,11 +150,16 @@ def main(cfg: DictConfig) -> None:
             errors.append(error)
 
     if parallel:
-        logging.info(f'Parallelizing verification of {len(input_args)} aois...')
-        with multiprocessing.get_context('spawn').Pool(processes=None) as pool:
-            lines = pool.map_async(map_wrapper, input_args).get()
-        report_list.extend([aoi_dict for aoi_dict, _ in lines])
-        errors.extend([error for _, error in lines])
+        # Cap workers at the number of aois: spawned workers re-import this project and idle ones only add startup
+        # cost. imap (rather than map_async) yields results as workers finish, so reports stream into the list and
+        # progress is visible instead of blocking until the whole batch is done.
+        processes = min(len(input_args), multiprocessing.cpu_count())
+        logging.info(f'Parallelizing verification of {len(input_args)} aois over {processes} processes...')
+        with multiprocessing.get_context('spawn').Pool(processes=processes) as pool:
+            for aoi_dict, error in tqdm(pool.imap(map_wrapper, input_args), total=len(input_args),
+                                        position=0, desc="Verifying data"):
+                report_list.append(aoi_dict)
+                errors.append(error)
 
     logging.info(f"\nWriting to csv: {outpath_csv}...")
     with open(outpath_csv, 'w', newline='') as output_file: